@@ -4,27 +4,63 @@ Flask web server for Render deployment - Word documents only
 """
 
 import os
+import sys
 import tempfile
 import zipfile
 import shutil
-from datetime import datetime
-from pathlib import Path
+from datetime import datetime, date
 import uuid
+from bisect import bisect_right
+import functools
+import hashlib
+import logging
+import multiprocessing
+from urllib.parse import quote
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from copy import deepcopy
+from io import BytesIO
+from itertools import islice, zip_longest
 
 from flask import Flask, request, jsonify, send_file, session
+from flask_compress import Compress
 from werkzeug.utils import secure_filename
 from docx import Document
-from docx.enum.text import WD_BREAK
+from docx.enum.section import WD_SECTION_START
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import nsdecls, qn
+from docx.text.paragraph import Paragraph
+from lxml import etree
 import openpyxl
 import re
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Optional, Tuple
+from xml.sax.saxutils import escape
 
-from jinja2 import Template
 from word_splitter import WordSplitter
 
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # Fall back to openpyxl for reading Excel files
+    CalamineWorkbook = None
+
+# Merge progress goes through logging; LOG_LEVEL=DEBUG shows per-record lines. An unknown
+# level name falls back to INFO instead of stopping every worker from starting
+_log_level = logging.getLevelName(os.environ.get('LOG_LEVEL', 'INFO').upper())
+logging.basicConfig(level=_log_level if isinstance(_log_level, int) else logging.INFO)
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
 
+# Compress JSON, HTML, CSS and JS responses above 1KB
+app.config['COMPRESS_ALGORITHM'] = ['br', 'zstd', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = 1024
+Compress(app)
+
 # Configure session management for production
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-' + str(uuid.uuid4()))
 app.config['SESSION_TYPE'] = 'filesystem'
@@ -34,74 +70,351 @@ app.config['SESSION_KEY_PREFIX'] = 'mailmerge:'
 
 # Configure folders
 UPLOAD_FOLDER = tempfile.mkdtemp()
-OUTPUT_FOLDER = tempfile.mkdtemp()
+OUTPUT_FOLDER = os.environ.get('OUTPUT_FOLDER') or tempfile.mkdtemp()
+os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Internal nginx location aliasing OUTPUT_FOLDER (e.g. "/protected/"); when set, downloads are
+# handed to nginx with X-Accel-Redirect instead of being streamed through a worker
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
+
+# Worker processes used to merge large jobs; 1 keeps merging in the request's own process
+MERGE_WORKERS = max(1, int(os.environ.get('MERGE_WORKERS', '1')))
+# Smallest record count worth sending to the worker pool
+MERGE_POOL_MIN_RECORDS = 50
+
 ALLOWED_TEMPLATE_EXTENSIONS = {'docx'}
 ALLOWED_DATA_EXTENSIONS = {'xlsx'}
 
+# Translation table mapping characters that are invalid in file names (including control
+# characters) to '_'
+_FN_TRANS = str.maketrans({c: '_' for c in '<>:"/\\|?*' + ''.join(map(chr, range(32)))})
+
+# Longest UTF-8 encoded file name stem used for generated documents, leaving room under the
+# 255-byte limit for a duplicate counter and the extension
+_MAX_FILENAME_BYTES = 200
+
+# Paragraph containing a single page break, inserted between merged records
+_PAGE_BREAK_XML = f'<w:p {nsdecls("w")}><w:r><w:br w:type="page"/></w:r></w:p>'.encode('utf-8')
+
+# Merge fields look like {{field_name}}
+_MERGE_RE = re.compile(r'\{\{(\w+)\}\}')
+# Start tag of a w:t element whose text holds a merge field, and an xml:space attribute within it
+_FIELD_TEXT_START_RE = re.compile(r'<w:t(\s[^>]*)?>(?=[^<]*\{\{\w+\}\})')
+_XML_SPACE_RE = re.compile(r'\s+xml:space="[^"]*"')
+
+# Package parts that can contain merge fields when rendering a template at the XML level
+_MERGE_PART_RE = re.compile(r'word/(document|header|footer)\d*\.xml')
+
+# Namespace-qualified tag names used while walking document XML
+_W_BODY = qn('w:body')
+_W_P = qn('w:p')
+_W_R = qn('w:r')
+_W_SECTPR = qn('w:sectPr')
+
+# Main document part, the only one whose content is copied for records after the first
+_DOCUMENT_PART = 'word/document.xml'
+
+# Values containing control characters (line breaks, tabs, ...) need python-docx to become w:br/w:tab
+_CONTROL_CHAR_RE = re.compile(r'[\x00-\x1f]')
+
+def _synchronized(method):
+    """Run a processor method while holding that processor's lock"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def _remove_file(path: Optional[str]) -> bool:
+    """Delete a file with a single syscall, returning False if there was nothing to delete"""
+    if not path:
+        return False
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
 def allowed_file(filename, allowed_extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
+def _iter_paragraph_elements(doc):
+    """Yield every body w:p element in document order, then header and footer paragraphs"""
+    # Walk the XML directly, which also reaches paragraphs in nested tables, text boxes and
+    # content controls; body paragraphs come first so their positions match body.iter(w:p)
+    yield from doc.element.body.iter(_W_P)
+    
+    for section in doc.sections:
+        yield from section.header._element.iter(_W_P)
+        yield from section.footer._element.iter(_W_P)
+
+def _cell_to_str(value) -> str:
+    """Convert an Excel cell value to the same string openpyxl-based loading produces"""
+    if value is None:
+        return ""
+    # calamine reports every number as a float, openpyxl reads whole numbers as int
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e16:
+        return str(int(value))
+    # calamine returns plain dates where openpyxl returns midnight datetimes
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return str(datetime.combine(value, datetime.min.time()))
+    return str(value)
+
+def _split_paragraph(full_text: str, matches: List[re.Match], data_row: Mapping[str, str]) -> List[tuple]:
+    """Split paragraph text into (source_position, text) segments with merge fields substituted"""
+    segments = []
+    current_pos = 0
+    
+    for match in matches:
+        start_pos, end_pos = match.span()
+        
+        # Text before the merge field keeps its own position
+        if start_pos > current_pos:
+            segments.append((current_pos, full_text[current_pos:start_pos]))
+        
+        # The replacement takes the position (and so the formatting) of the merge field
+        replacement_text = str(data_row.get(match.group(1), ""))
+        if replacement_text:
+            segments.append((start_pos, replacement_text))
+        
+        current_pos = end_pos
+    
+    # Remaining text after the last merge field
+    if current_pos < len(full_text):
+        segments.append((current_pos, full_text[current_pos:]))
+    
+    return segments
+
+def _rows_to_columns(rows, width: int) -> List[List[str]]:
+    """Transpose raw Excel rows into one list of merge strings per header column"""
+    columns = [list(map(_cell_to_str, column)) for column in islice(zip_longest(*rows), width)]
+    
+    # Rows narrower than the header row leave trailing columns empty
+    record_count = len(columns[0]) if columns else 0
+    while len(columns) < width:
+        columns.append([""] * record_count)
+    
+    return columns
+
+def _active_sheet_index(data_path: str) -> int:
+    """Return the position of the workbook's active sheet, the one openpyxl's workbook.active reads"""
+    try:
+        with zipfile.ZipFile(data_path) as zf:
+            workbook_xml = parse_xml(zf.read('xl/workbook.xml'))
+        view = next(workbook_xml.iter('{*}workbookView'), None)
+        return int(view.get('activeTab', 0)) if view is not None else 0
+    except (KeyError, ValueError, zipfile.BadZipFile, etree.XMLSyntaxError):
+        return 0
+
+def _preserve_field_space(match) -> str:
+    """Rewrite a w:t start tag so Word keeps leading and trailing spaces in substituted values"""
+    attributes = _XML_SPACE_RE.sub('', match.group(1) or '')
+    return f'<w:t{attributes} xml:space="preserve">'
+
+def _render_xml(xml: str, data_row: Mapping[str, str]) -> str:
+    """Substitute merge fields in template XML with XML-escaped record values"""
+    def field_value(match):
+        return escape(str(data_row.get(match.group(1), "")), {'"': '&quot;'})
+    
+    return _MERGE_RE.sub(field_value, xml)
+
+class _RecordView(Mapping):
+    """Read-only mapping of one record's values by header, backed by the column lists"""
+    __slots__ = ('_index', '_columns', '_row')
+    
+    def __init__(self, index: Dict[str, int], columns: List[List[str]], row: int):
+        self._index = index
+        self._columns = columns
+        self._row = row
+    
+    def __getitem__(self, key):
+        return self._columns[self._index[key]][self._row]
+    
+    def get(self, key, default=None):
+        position = self._index.get(key)
+        return default if position is None else self._columns[position][self._row]
+    
+    def __iter__(self):
+        return iter(self._index)
+    
+    def __len__(self):
+        return len(self._index)
+
+class _RecordTable(Sequence):
+    """Records stored column by column, exposed as a sequence of lightweight row views"""
+    
+    def __init__(self, headers: Tuple[str, ...], columns: List[List[str]]):
+        # Later duplicate headers win, as they did when each record was a dict
+        self._index = {header: position for position, header in enumerate(headers)}
+        self._columns = columns
+        self._length = len(columns[0]) if columns else 0
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [_RecordView(self._index, self._columns, row) for row in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("record index out of range")
+        return _RecordView(self._index, self._columns, index)
+    
+    def __iter__(self):
+        for row in range(self._length):
+            yield _RecordView(self._index, self._columns, row)
+    
+    def __len__(self):
+        return self._length
+
 class MailMergeProcessor:
     def __init__(self, session_id=None):
         self.session_id = session_id or str(uuid.uuid4())
+        self.last_used = time.monotonic()
+        # Threaded workers can serve several requests for one session at once; uploads, merges
+        # and status recovery hold this (re-entrant) lock so they never interleave
+        self.lock = threading.RLock()
         self.template_path: Optional[str] = None
         self.data_path: Optional[str] = None
-        self.data: List[Dict[str, Any]] = []
-        self.headers: List[str] = []  # Store Excel column headers
-        
+        self.data: Sequence[Mapping[str, str]] = []  # Row views over self.columns
+        self.headers: Tuple[str, ...] = ()  # Store Excel column headers
+        self.columns: List[List[str]] = []  # One list of cell strings per header
+        # Positions (in _iter_paragraph_elements order) of template paragraphs that contain merge fields
+        self._merge_paragraph_indices: List[int] = []
+        # Raw .docx bytes of the template, read once so records don't re-read the file
+        self._template_bytes: Optional[bytes] = None
+        # Parsed template body, deep-copied when only a record's body content is needed
+        self._template_body = None
+        # Positions (in body w:p document order) of body paragraphs that contain merge fields
+        self._body_merge_indices: List[int] = []
+        # Template XML parts keyed by part name, or None when fields can't be rendered at the XML level
+        self._xml_templates: Optional[Dict[str, str]] = None
+        # Bumped whenever the template or data changes, so outputs merged from older inputs are never reused
+        self._inputs_generation = 0
+        # Last generated output per format as (generation, path, size, mtime_ns)
+        self._output_cache: Dict[str, Tuple[int, str, int, int]] = {}
+        
+    @_synchronized
     def cleanup(self):
         """Clean up temporary files"""
         try:
-            if self.template_path and os.path.exists(self.template_path):
-                os.remove(self.template_path)
-                print(f"Cleaned up template: {self.template_path}")
+            if _remove_file(self.template_path):
+                logger.info("Cleaned up template: %s", self.template_path)
             
-            if self.data_path and os.path.exists(self.data_path):
-                os.remove(self.data_path)
-                print(f"Cleaned up data file: {self.data_path}")
+            if _remove_file(self.data_path):
+                logger.info("Cleaned up data file: %s", self.data_path)
                 
         except Exception as e:
-            print(f"Cleanup error: {str(e)}")
+            logger.error("Cleanup error: %s", e)
         
         # Reset state
         self.template_path = None
         self.data_path = None
         self.data = []
-        self.headers = []
-        
+        self.headers = ()
+        self.columns = []
+        self._merge_paragraph_indices = []
+        self._template_bytes = None
+        self._template_body = None
+        self._body_merge_indices = []
+        self._xml_templates = None
+        self._inputs_generation += 1
+        self._output_cache = {}
+        
+    @_synchronized
     def load_template(self, template_path: str) -> bool:
         """Load and validate Word template file"""
         try:
-            # Clean up previous template
-            if self.template_path and os.path.exists(self.template_path):
-                os.remove(self.template_path)
-            
             if not os.path.exists(template_path):
                 raise FileNotFoundError(f"Template file not found: {template_path}")
             
             if not template_path.lower().endswith('.docx'):
                 raise ValueError("Template must be a Word document (.docx)")
             
-            # Test if file can be opened
-            doc = Document(template_path)
-            doc = None  # Close the document
+            with open(template_path, 'rb') as f:
+                template_bytes = f.read()
+            
+            # Only check the package structure here; the template is parsed on its first merge
+            with zipfile.ZipFile(BytesIO(template_bytes)) as zf:
+                names = set(zf.namelist())
+            if '[Content_Types].xml' not in names or _DOCUMENT_PART not in names:
+                raise ValueError("Template is not a valid Word document")
+            
+            # Only replace the previous template once the new one has passed validation
+            # (status recovery may already have registered this same path)
+            if self.template_path != template_path:
+                _remove_file(self.template_path)
+            self._inputs_generation += 1
+            self._output_cache = {}
+            
+            self._template_bytes = template_bytes
+            self._template_body = None
+            self._xml_templates = None
             
             self.template_path = template_path
-            print(f"Template loaded successfully: {template_path}")
+            logger.info("Template loaded successfully: %s", template_path)
             return True
             
         except Exception as e:
-            print(f"Error loading template: {str(e)}")
+            logger.error("Error loading template: %s", e)
             return False
     
+    def _prepare_template(self, template_bytes: bytes):
+        """Parse the template once and cache everything per-record merging needs"""
+        # Remember which paragraphs hold merge fields, so per-record processing can skip
+        # the rest without re-scanning their text
+        doc = Document(BytesIO(template_bytes))
+        self._merge_paragraph_indices = [
+            index for index, p in enumerate(_iter_paragraph_elements(doc))
+            if '{{' in Paragraph(p, None).text
+        ]
+        self._template_body = doc.element.body
+        # Body paragraphs lead that walk, so the same positions index body.iter(w:p) and every
+        # record (first or later, full document or body only) gets the same paragraphs merged
+        body_paragraph_count = sum(1 for _ in self._template_body.iter(_W_P))
+        self._body_merge_indices = [
+            index for index in self._merge_paragraph_indices if index < body_paragraph_count
+        ]
+        self._template_bytes = template_bytes
+        self._xml_templates = self._load_xml_templates(template_bytes)
+    
+    def _ensure_template_prepared(self):
+        """Parse the uploaded template if it hasn't been merged yet"""
+        if self._template_body is None:
+            self._prepare_template(self._template_bytes)
+    
+    def _load_xml_templates(self, template_bytes: bytes) -> Optional[Dict[str, str]]:
+        """Read the document, header and footer XML parts if every merge field in them is intact"""
+        try:
+            xml_templates = {}
+            with zipfile.ZipFile(BytesIO(template_bytes)) as zf:
+                for name in zf.namelist():
+                    if not _MERGE_PART_RE.fullmatch(name):
+                        continue
+                    
+                    xml = zf.read(name).decode('utf-8')
+                    # A field split across runs leaves a '{{' the regex can't match; such
+                    # templates need the run-aware python-docx path
+                    if xml.count('{{') != len(_MERGE_RE.findall(xml)):
+                        logger.info("Merge fields split across runs in %s, using run-level replacement", name)
+                        return None
+                    # Values may start or end with spaces, which Word drops unless the w:t preserves them
+                    xml_templates[name] = _FIELD_TEXT_START_RE.sub(_preserve_field_space, xml)
+            
+            return xml_templates
+            
+        except Exception as e:
+            logger.warning("Could not prepare XML templates: %s", e)
+            return None
+    
+    @_synchronized
     def load_data(self, data_path: str) -> bool:
         """Load and validate Excel data file"""
         try:
-            # Clean up previous data file
-            if self.data_path and os.path.exists(self.data_path):
-                os.remove(self.data_path)
+            # Clean up previous data file (status recovery may already have registered this one)
+            if self.data_path != data_path:
+                _remove_file(self.data_path)
+            self._inputs_generation += 1
+            self._output_cache = {}
             
             if not os.path.exists(data_path):
                 raise FileNotFoundError(f"Data file not found: {data_path}")
@@ -109,545 +422,593 @@ class MailMergeProcessor:
             if not data_path.lower().endswith('.xlsx'):
                 raise ValueError("Data file must be an Excel file (.xlsx)")
             
-            # Load Excel data using openpyxl
-            workbook = openpyxl.load_workbook(data_path, data_only=True)
-            sheet = workbook.active
-            
-            if sheet.max_row <= 1:
-                workbook.close()
-                raise ValueError("Excel file appears to be empty or has no data")
-            
-            # Convert to list of dictionaries
-            self.headers = []  # Store headers as instance variable
-            for cell in sheet[1]:
-                self.headers.append(str(cell.value) if cell.value is not None else "")
-            
-            self.data = []
-            for row in sheet.iter_rows(min_row=2, values_only=True):
-                row_data = {}
-                for i, value in enumerate(row):
-                    if i < len(self.headers):
-                        row_data[self.headers[i]] = str(value) if value is not None else ""
-                self.data.append(row_data)
-            
-            workbook.close()
+            if CalamineWorkbook is not None:
+                # Load Excel data using python-calamine (native xlsx parser), from the same
+                # active sheet the openpyxl path reads
+                workbook = CalamineWorkbook.from_path(data_path)
+                sheet_index = _active_sheet_index(data_path)
+                if not 0 <= sheet_index < len(workbook.sheet_names):
+                    sheet_index = 0
+                rows = workbook.get_sheet_by_index(sheet_index).to_python(skip_empty_area=False)
+                
+                if len(rows) <= 1:
+                    raise ValueError("Excel file appears to be empty or has no data")
+                
+                # Store the data column by column under interned headers
+                self.headers = tuple(sys.intern(_cell_to_str(value)) for value in rows[0])
+                self.columns = _rows_to_columns(rows[1:], len(self.headers))
+            else:
+                # Load Excel data using openpyxl, streaming rows in read-only mode
+                workbook = openpyxl.load_workbook(data_path, read_only=True, data_only=True)
+                try:
+                    sheet = workbook.active
+                    # The stored <dimension> can be stale or missing, so read every row present instead
+                    sheet.reset_dimensions()
+                    rows = sheet.iter_rows(values_only=True)
+                    header_row = next(rows, None)
+                    
+                    if header_row is None:
+                        raise ValueError("Excel file appears to be empty or has no data")
+                    
+                    # Store the data column by column under interned headers
+                    self.headers = tuple(sys.intern(_cell_to_str(value)) for value in header_row)
+                    self.columns = _rows_to_columns(rows, len(self.headers))
+                finally:
+                    workbook.close()
             
+            self.data = _RecordTable(self.headers, self.columns)
             if not self.data:
                 raise ValueError("No data rows found in Excel file")
             
             self.data_path = data_path
-            print(f"Data loaded successfully: {len(self.data)} records from {data_path}")
+            logger.info("Data loaded successfully: %d records from %s", len(self.data), data_path)
             return True
             
         except Exception as e:
-            print(f"Error loading data: {str(e)}")
+            logger.error("Error loading data: %s", e)
             return False
 
-    def _find_run_for_position(self, paragraph, text_position):
-        """Find which run contains the text at the given position and return its formatting"""
-        current_pos = 0
-        
-        for run in paragraph.runs:
-            run_len = len(run.text)
-            
-            if current_pos <= text_position < current_pos + run_len:
-                # Extract formatting from this run
-                formatting = {
-                    'bold': run.bold,
-                    'italic': run.italic,
-                    'underline': run.underline,
-                    'font_name': run.font.name,
-                    'font_size': run.font.size,
-                    'font_color': run.font.color.rgb if run.font.color.rgb else None
-                }
-                return {'formatting': formatting}
-            
-            current_pos += run_len
+    def _find_run_for_position(self, run_ends: List[int], run_props: list, text_position):
+        """Find which run contains the text at the given position and return its w:rPr element"""
+        # run_ends holds each run's cumulative end offset, so the first end past the position
+        # belongs to the run containing it (empty runs never match)
+        index = bisect_right(run_ends, text_position)
+        if index < len(run_props):
+            return run_props[index]
         
         # If position not found, return formatting from first run
-        if paragraph.runs:
-            first_run = paragraph.runs[0]
-            formatting = {
-                'bold': first_run.bold,
-                'italic': first_run.italic,
-                'underline': first_run.underline,
-                'font_name': first_run.font.name,
-                'font_size': first_run.font.size,
-                'font_color': first_run.font.color.rgb if first_run.font.color.rgb else None
-            }
-            return {'formatting': formatting}
+        if run_props:
+            return run_props[0]
         
         return None
 
-    def _apply_formatting(self, run, formatting):
-        """Apply formatting to a run"""
-        try:
-            if formatting.get('bold') is not None:
-                run.bold = formatting['bold']
-            if formatting.get('italic') is not None:
-                run.italic = formatting['italic']
-            if formatting.get('underline') is not None:
-                run.underline = formatting['underline']
-            if formatting.get('font_name'):
-                run.font.name = formatting['font_name']
-            if formatting.get('font_size'):
-                run.font.size = formatting['font_size']
-            if formatting.get('font_color'):
-                run.font.color.rgb = formatting['font_color']
-        except Exception as e:
-            print(f"Error applying formatting: {e}")
-            # Continue without formatting if there's an error
-
-    def replace_merge_fields_advanced(self, paragraph, data_row: Dict[str, Any]):
+    def replace_merge_fields_advanced(self, paragraph, data_row: Mapping[str, str]):
         """Advanced merge field replacement that preserves individual character formatting"""
-        full_text = paragraph.text
+        # Read the runs once; the paragraph text is just their concatenation
+        runs = paragraph.runs
+        run_texts = [run.text for run in runs]
+        full_text = ''.join(run_texts)
         
         # Find all merge fields
-        merge_fields = re.finditer(r'\{\{(\w+)\}\}', full_text)
+        merge_fields = _MERGE_RE.finditer(full_text)
         merge_list = list(merge_fields)
         
         if not merge_list:
             return
         
-        # Create a list to store new runs
-        new_runs_data = []
-        current_pos = 0
-        
-        for match in merge_list:
-            field_name = match.group(1)
-            start_pos = match.start()
-            end_pos = match.end()
-            replacement_text = str(data_row.get(field_name, ""))
-            
-            # Add text before the merge field
-            if start_pos > current_pos:
-                before_text = full_text[current_pos:start_pos]
-                if before_text:
-                    # Find the run that contains this text and its formatting
-                    run_info = self._find_run_for_position(paragraph, current_pos)
-                    new_runs_data.append({
-                        'text': before_text,
-                        'formatting': run_info['formatting'] if run_info else None
-                    })
-            
-            # Add the replacement text with the formatting of the merge field location
-            if replacement_text:
-                run_info = self._find_run_for_position(paragraph, start_pos)
-                new_runs_data.append({
-                    'text': replacement_text,
-                    'formatting': run_info['formatting'] if run_info else None
-                })
+        # When every field sits inside a single run, substitute run by run in one regex pass
+        # each and leave the run structure untouched
+        field_runs = [(run, text) for run, text in zip(runs, run_texts) if '{{' in text]
+        if sum(len(_MERGE_RE.findall(text)) for _, text in field_runs) == len(merge_list):
+            def field_value(match):
+                return str(data_row.get(match.group(1), ""))
             
-            current_pos = end_pos
-        
-        # Add remaining text after the last merge field
-        if current_pos < len(full_text):
-            remaining_text = full_text[current_pos:]
-            if remaining_text:
-                run_info = self._find_run_for_position(paragraph, current_pos)
-                new_runs_data.append({
-                    'text': remaining_text,
-                    'formatting': run_info['formatting'] if run_info else None
-                })
-        
-        # Clear existing runs
-        for run in paragraph.runs:
-            run.clear()
+            for run, text in field_runs:
+                run.text = _MERGE_RE.sub(field_value, text)
+            return
         
-        # Create new runs with preserved formatting
-        for run_data in new_runs_data:
-            if run_data['text']:
-                new_run = paragraph.add_run(run_data['text'])
-                if run_data['formatting']:
-                    self._apply_formatting(new_run, run_data['formatting'])
+        # Offset table for locating the run at each source position
+        run_ends = []
+        offset = 0
+        for text in run_texts:
+            offset += len(text)
+            run_ends.append(offset)
+        run_props = [run._r.rPr for run in runs]
+        
+        # Build the new runs, each carrying a copy of the run properties at its source position
+        new_runs = []
+        for position, text in _split_paragraph(full_text, merge_list, data_row):
+            new_run = OxmlElement('w:r')
+            rpr = self._find_run_for_position(run_ends, run_props, position)
+            if rpr is not None:
+                new_run.append(deepcopy(rpr))
+            new_run.text = text
+            new_runs.append(new_run)
+        
+        # Swap the existing runs for the new ones in a single pass
+        p_elem = paragraph._p
+        for r in p_elem.findall(_W_R):
+            p_elem.remove(r)
+        p_elem.extend(new_runs)
     
-    def replace_merge_fields(self, doc: Document, data_row: Dict[str, Any]) -> Document:
+    def replace_merge_fields(self, doc: Document, data_row: Mapping[str, str]) -> Document:
         """Replace merge fields with actual data while preserving formatting"""
         
-        # Replace in paragraphs with advanced formatting preservation
-        for paragraph in doc.paragraphs:
-            if '{{' in paragraph.text and '}}' in paragraph.text:
-                self.replace_merge_fields_advanced(paragraph, data_row)
-        
-        # Replace in tables
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        if '{{' in paragraph.text and '}}' in paragraph.text:
-                            self.replace_merge_fields_advanced(paragraph, data_row)
-        
-        # Replace in headers and footers
-        for section in doc.sections:
-            # Header
-            if section.header:
-                for paragraph in section.header.paragraphs:
-                    if '{{' in paragraph.text and '}}' in paragraph.text:
-                        self.replace_merge_fields_advanced(paragraph, data_row)
-            
-            # Footer
-            if section.footer:
-                for paragraph in section.footer.paragraphs:
-                    if '{{' in paragraph.text and '}}' in paragraph.text:
-                        self.replace_merge_fields_advanced(paragraph, data_row)
+        # Every record is built from the same template, so the paragraphs found at
+        # template-load time line up with this document's paragraphs by position
+        paragraphs = list(_iter_paragraph_elements(doc))
+        for index in self._merge_paragraph_indices:
+            self.replace_merge_fields_advanced(Paragraph(paragraphs[index], None), data_row)
         
         return doc
     
+    def _can_render_xml(self, data_row: Mapping[str, str]) -> bool:
+        """Check whether a record can be merged by rendering the template XML directly"""
+        if self._xml_templates is None:
+            return False
+        return not any(_CONTROL_CHAR_RE.search(str(value)) for value in data_row.values())
+    
+    def _render_docx_bytes(self, data_row: Mapping[str, str], transient: bool = False) -> bytes:
+        """Render one record into a complete .docx by substituting fields in the template XML
+        
+        Transient packages are only parsed back in memory, so their parts are stored uncompressed.
+        """
+        rendered = {name: _render_xml(xml, data_row) for name, xml in self._xml_templates.items()}
+        # None keeps each part's compression from the template
+        compress_type = zipfile.ZIP_STORED if transient else None
+        
+        buf = BytesIO()
+        with zipfile.ZipFile(BytesIO(self._template_bytes)) as src, zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as dst:
+            for item in src.infolist():
+                if item.filename in rendered:
+                    dst.writestr(item, rendered[item.filename].encode('utf-8'), compress_type)
+                else:
+                    dst.writestr(item, src.read(item), compress_type)
+        return buf.getvalue()
+    
+    def _merge_record(self, data_row: Mapping[str, str]) -> Document:
+        """Create the merged document for a single record"""
+        if self._can_render_xml(data_row):
+            return Document(BytesIO(self._render_docx_bytes(data_row, transient=True)))
+        return self.replace_merge_fields(Document(BytesIO(self._template_bytes)), data_row)
+    
+    def _merge_record_bytes(self, data_row: Mapping[str, str]) -> bytes:
+        """Create the merged .docx bytes for a single record"""
+        if self._can_render_xml(data_row):
+            return self._render_docx_bytes(data_row)
+        return self._save_to_bytes(self.replace_merge_fields(Document(BytesIO(self._template_bytes)), data_row))
+    
+    def _merge_record_body(self, data_row: Mapping[str, str]) -> list:
+        """Create the merged body content (without the body-level sectPr) for a single record"""
+        if self._can_render_xml(data_row):
+            # Only the main document part is needed, headers and footers come from the first record
+            root = parse_xml(_render_xml(self._xml_templates[_DOCUMENT_PART], data_row).encode('utf-8'))
+            body = root.find(_W_BODY)
+        else:
+            body = deepcopy(self._template_body)
+            paragraphs = list(body.iter(_W_P))
+            for index in self._body_merge_indices:
+                self.replace_merge_fields_advanced(Paragraph(paragraphs[index], None), data_row)
+        
+        return [child for child in body if child.tag != _W_SECTPR]
+    
+    def _iter_merged(self, records: list, merge, worker, decode=None):
+        """Yield merge(record) for each record in order, farming large jobs out to worker processes"""
+        if MERGE_WORKERS <= 1 or len(records) < MERGE_POOL_MIN_RECORDS:
+            yield from map(merge, records)
+            return
+        
+        logger.info("Merging %d records with %d worker processes", len(records), MERGE_WORKERS)
+        pool = _get_merge_pool()
+        # Workers keep the last template they prepared, keyed by a digest of its bytes
+        template_key = hashlib.blake2s(self._template_bytes).hexdigest()
+        chunksize = max(1, len(records) // (4 * MERGE_WORKERS))
+        try:
+            # Row views share the whole column store, so send each worker plain dicts
+            futures = [
+                pool.submit(worker, template_key, self._template_bytes,
+                            [dict(record) for record in records[start:start + chunksize]])
+                for start in range(0, len(records), chunksize)
+            ]
+            for future in futures:
+                results = future.result()
+                yield from results if decode is None else map(decode, results)
+        except BrokenProcessPool:
+            _reset_merge_pool(pool)
+            raise
+    
+    def _append_body_content(self, final_doc: Document, body_children: list, page_break: bool = False):
+        """Append record body content to final_doc as raw XML, keeping final_doc's sectPr last"""
+        final_body = final_doc.element.body
+        sect_pr = final_body.find(_W_SECTPR)
+        
+        new_children = [parse_xml(_PAGE_BREAK_XML)] if page_break else []
+        new_children.extend(body_children)
+        
+        # The body-level sectPr must stay the last child, so detach it around the bulk insert
+        if sect_pr is not None:
+            final_body.remove(sect_pr)
+        final_body.extend(new_children)
+        if sect_pr is not None:
+            final_body.append(sect_pr)
+    
     def generate_single_word(self, output_path: str) -> bool:
         """Generate a single Word document using SECTION BREAKS - Most reliable method"""
         try:
             if not self.template_path or not self.data:
                 raise ValueError("Template and data must be loaded first")
             
-            print(f"Creating single Word document with {len(self.data)} records using SECTION BREAKS...")
+            logger.info("Creating single Word document with %d records using SECTION BREAKS...", len(self.data))
             
             # Start with first record - load fresh template and process
-            final_doc = Document(self.template_path)
-            final_doc = self.replace_merge_fields(final_doc, self.data[0])
-            print(f"Added record 1 of {len(self.data)}")
+            final_doc = self._merge_record(self.data[0])
+            logger.debug("Added record 1 of %d", len(self.data))
             
-            # Add remaining records using section breaks
-            for i, row_data in enumerate(self.data[1:], 1):
-                print(f"Adding record {i+1} of {len(self.data)} with section break...")
-                
-                # Load and process template for this record
-                template_doc = Document(self.template_path)
-                processed_doc = self.replace_merge_fields(template_doc, row_data)
+            # Add remaining records using section breaks, merging only the body content of each
+            bodies = self._iter_merged(self.data[1:], self._merge_record_body,
+                                       _merge_record_body_worker, _parse_body_children)
+            for i, body_children in enumerate(bodies, 1):
+                logger.debug("Adding record %d of %d with section break...", i + 1, len(self.data))
                 
                 # Add new section with NEW_PAGE start (more reliable than page breaks)
-                from docx.enum.section import WD_SECTION_START
-                new_section = final_doc.add_section(WD_SECTION_START.NEW_PAGE)
-                
-                # Copy all content from processed template to the new section
-                # Get the section element and body
-                section_element = new_section._sectPr
-                body_element = final_doc._body._body
+                final_doc.add_section(WD_SECTION_START.NEW_PAGE)
                 
-                # Copy all paragraphs from processed document
-                for para in processed_doc.paragraphs:
-                    new_para = final_doc.add_paragraph()
-                    
-                    # Copy paragraph-level formatting
-                    try:
-                        new_para.style = para.style
-                        new_para.alignment = para.alignment
-                    except:
-                        pass
-                    
-                    # Copy all runs with their formatting
-                    for run in para.runs:
-                        new_run = new_para.add_run(run.text)
-                        
-                        # Copy comprehensive formatting
-                        try:
-                            if run.bold is not None:
-                                new_run.bold = run.bold
-                            if run.italic is not None:
-                                new_run.italic = run.italic
-                            if run.underline is not None:
-                                new_run.underline = run.underline
-                            if run.font.size:
-                                new_run.font.size = run.font.size
-                            if run.font.name:
-                                new_run.font.name = run.font.name
-                            if run.font.color.rgb:
-                                new_run.font.color.rgb = run.font.color.rgb
-                        except:
-                            pass
-                
-                # Copy tables from processed document
-                for table in processed_doc.tables:
-                    new_table = final_doc.add_table(rows=len(table.rows), cols=len(table.columns))
-                    
-                    # Copy table content with formatting
-                    for row_idx, row in enumerate(table.rows):
-                        for col_idx, cell in enumerate(row.cells):
-                            new_cell = new_table.cell(row_idx, col_idx)
-                            new_cell.text = ""  # Clear default text
-                            
-                            for para in cell.paragraphs:
-                                if para.text.strip() or len(para.runs) > 0:
-                                    new_para = new_cell.add_paragraph()
-                                    for run in para.runs:
-                                        new_run = new_para.add_run(run.text)
-                                        try:
-                                            if run.bold is not None:
-                                                new_run.bold = run.bold
-                                            if run.italic is not None:
-                                                new_run.italic = run.italic
-                                        except:
-                                            pass
+                # Move the merged content into the new section
+                self._append_body_content(final_doc, body_children)
             
             # Save the final document
-            final_doc.save(output_path)
-            print(f"✅ Successfully created single Word document using section breaks")
+            self._write_document(final_doc, output_path)
+            logger.info("✅ Successfully created single Word document using section breaks")
             return True
             
         except Exception as e:
-            print(f"❌ Error creating single Word document: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("❌ Error creating single Word document: %s", e)
             
             # Fallback to traditional approach if section breaks fail
-            print("🔄 Trying fallback approach with traditional page breaks...")
+            logger.info("🔄 Trying fallback approach with traditional page breaks...")
             return self.generate_single_word_fallback(output_path)
 
     def generate_single_word_fallback(self, output_path: str) -> bool:
         """Fallback method using traditional page breaks with XML manipulation"""
         try:
-            print("Using fallback method with XML-level page break insertion...")
-            
-            # Process all records first
-            all_processed_docs = []
-            for i, row_data in enumerate(self.data):
-                template_doc = Document(self.template_path)
-                processed_doc = self.replace_merge_fields(template_doc, row_data)
-                all_processed_docs.append(processed_doc)
-                print(f"Processed record {i+1} of {len(self.data)}")
+            logger.info("Using fallback method with XML-level page break insertion...")
             
-            # Start with first document
-            final_doc = all_processed_docs[0]
+            # Start with the first record as a complete document
+            final_doc = self._merge_record(self.data[0])
             
-            # Add remaining documents with XML page breaks
-            for i, doc in enumerate(all_processed_docs[1:], 1):
-                print(f"Merging record {i+1} with XML page break...")
-                
-                # Insert page break at XML level (more reliable)
-                body = final_doc._body._body
-                
-                # Create page break paragraph
-                from docx.oxml import parse_xml
-                from docx.oxml.ns import nsdecls, qn
-                
-                # Add page break using XML
-                page_break_xml = f'''
-                <w:p {nsdecls('w')}>
-                    <w:r>
-                        <w:br w:type="page"/>
-                    </w:r>
-                </w:p>
-                '''
-                page_break_p = parse_xml(page_break_xml)
-                body.append(page_break_p)
-                
-                # Copy all content from the document
-                for para in doc.paragraphs:
-                    new_para = final_doc.add_paragraph()
-                    
-                    try:
-                        new_para.style = para.style
-                        new_para.alignment = para.alignment
-                    except:
-                        pass
-                    
-                    for run in para.runs:
-                        new_run = new_para.add_run(run.text)
-                        try:
-                            if run.bold is not None:
-                                new_run.bold = run.bold
-                            if run.italic is not None:
-                                new_run.italic = run.italic
-                            if run.underline is not None:
-                                new_run.underline = run.underline
-                        except:
-                            pass
+            # Add remaining records with XML page breaks
+            for i, row_data in enumerate(self.data[1:], 1):
+                logger.debug("Merging record %d with XML page break...", i + 1)
                 
-                # Copy tables
-                for table in doc.tables:
-                    new_table = final_doc.add_table(rows=len(table.rows), cols=len(table.columns))
-                    for row_idx, row in enumerate(table.rows):
-                        for col_idx, cell in enumerate(row.cells):
-                            new_table.cell(row_idx, col_idx).text = cell.text
+                # Insert page break at XML level (more reliable) followed by the record content
+                self._append_body_content(final_doc, self._merge_record_body(row_data), page_break=True)
             
-            final_doc.save(output_path)
-            print("✅ Fallback method successful")
+            self._write_document(final_doc, output_path)
+            logger.info("✅ Fallback method successful")
             return True
             
         except Exception as e:
-            print(f"❌ Fallback method also failed: {str(e)}")
+            logger.error("❌ Fallback method also failed: %s", e)
             return False
     
-    def generate_multiple_word(self, output_dir: str) -> bool:
-        """Generate multiple Word documents (one per record) - filename based on first column"""
+    def _save_to_bytes(self, doc: Document) -> bytes:
+        """Serialize a document to .docx bytes without touching the disk"""
+        buf = BytesIO()
+        doc.save(buf)
+        return buf.getvalue()
+    
+    def _write_document(self, doc: Document, output_path: str):
+        """Serialize a document in memory and write it to disk in a single call"""
+        data = self._save_to_bytes(doc)
+        with open(output_path, 'wb') as f:
+            f.write(data)
+    
+    def generate_multiple_word(self, output_path: str) -> bool:
+        """Generate multiple Word documents (one per record) in a ZIP archive - filename based on first column"""
         try:
             if not self.template_path or not self.data:
                 raise ValueError("Template and data must be loaded first")
             
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # Get the first column header for filename generation
+            # Get the first column for filename generation
             first_column_header = self.headers[0] if self.headers else None
-            print(f"Using first column '{first_column_header}' for filenames")
+            first_column = self.columns[0] if self.columns else None
+            logger.info("Using first column '%s' for filenames", first_column_header)
             
-            for index, row_data in enumerate(self.data):
-                # Load template
-                doc = Document(self.template_path)
-                
-                # Replace merge fields
-                processed_doc = self.replace_merge_fields(doc, row_data)
-                
-                # Generate filename using first column value
-                if first_column_header and first_column_header in row_data:
-                    filename_value = row_data[first_column_header]
-                else:
-                    # Fallback to first value in row or record number
-                    filename_value = list(row_data.values())[0] if row_data else f"record_{index+1}"
-                
-                # Clean filename - remove invalid characters for file system
-                safe_filename = re.sub(r'[<>:"/\\|?*]', '_', str(filename_value))
-                # Also remove leading/trailing spaces and dots
-                safe_filename = safe_filename.strip('. ')
-                # Ensure filename is not empty
-                if not safe_filename:
-                    safe_filename = f"record_{index+1}"
-                
-                output_path = os.path.join(output_dir, f"{safe_filename}.docx")
-                
-                # Handle duplicate filenames by adding index
-                counter = 1
-                base_path = output_path
-                while os.path.exists(output_path):
-                    name_without_ext = os.path.splitext(base_path)[0]
-                    output_path = f"{name_without_ext}_{counter}.docx"
-                    counter += 1
-                
-                processed_doc.save(output_path)
-                print(f"Created: {os.path.basename(output_path)}")
+            # Track names already written to the archive so duplicates get a suffix
+            existing_names = set()
+            
+            # Each document is written straight into the archive as it is produced; entries are
+            # stored uncompressed since .docx files are already deflate-compressed internally
+            documents = self._iter_merged(self.data[:], self._merge_record_bytes, _merge_record_bytes_worker)
+            with zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zipf:
+                for index, docx_bytes in enumerate(documents):
+                    # Generate filename using first column value, falling back to the record number
+                    filename_value = first_column[index] if first_column is not None else f"record_{index+1}"
+                    
+                    # Clean filename - remove invalid characters for file system
+                    safe_filename = str(filename_value).translate(_FN_TRANS)
+                    # Cap the encoded length, dropping any multi-byte character cut in half
+                    safe_filename = safe_filename.encode('utf-8')[:_MAX_FILENAME_BYTES].decode('utf-8', errors='ignore')
+                    # Also remove leading/trailing spaces and dots
+                    safe_filename = safe_filename.strip('. ')
+                    # Ensure filename is not empty
+                    if not safe_filename:
+                        safe_filename = f"record_{index+1}"
+                    
+                    # Handle duplicate filenames by adding index
+                    output_name = f"{safe_filename}.docx"
+                    counter = 1
+                    while output_name in existing_names:
+                        output_name = f"{safe_filename}_{counter}.docx"
+                        counter += 1
+                    existing_names.add(output_name)
+                    
+                    zipf.writestr(output_name, docx_bytes)
+                    logger.debug("Created: %s", output_name)
             
             return True
             
         except Exception as e:
-            print(f"Error creating multiple Word files: {str(e)}")
+            logger.error("Error creating multiple Word files: %s", e)
             return False
     
-
-    
-
-
-
-
-
+    def _cached_output(self, output_format: str, generation: int) -> Optional[str]:
+        """Return the cached output path for these inputs, or None if it is missing or was changed on disk"""
+        entry = self._output_cache.get(output_format)
+        if not entry or entry[0] != generation:
+            return None
+        _, path, size, mtime_ns = entry
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+            return None
+        return path
     
+    @_synchronized
     def process_merge(self, output_format: str, output_path: str) -> bool:
         """Main processing function"""
         try:
             if not self.template_path or not self.data:
                 raise ValueError("Both template and data files must be loaded")
             
+            # The same template and data were already merged to this format, copy that result
+            generation = self._inputs_generation
+            cached_path = self._cached_output(output_format, generation)
+            if cached_path:
+                shutil.copyfile(cached_path, output_path)
+                logger.info("Reused previous %s output: %s", output_format, cached_path)
+                return True
+            
+            self._ensure_template_prepared()
+            
             # Process based on output format
             if output_format == "single-word":
-                return self.generate_single_word(output_path)
+                success = self.generate_single_word(output_path)
             elif output_format == "multiple-word":
-                return self.generate_multiple_word(output_path)
+                success = self.generate_multiple_word(output_path)
             else:
                 raise ValueError(f"Unsupported output format: {output_format}")
+            
+            # Only remember the result if the inputs it was merged from are still the current ones
+            if success and generation == self._inputs_generation:
+                stat = os.stat(output_path)
+                self._output_cache[output_format] = (generation, output_path, stat.st_size, stat.st_mtime_ns)
+            return success
                 
         except Exception as e:
-            print(f"Error processing mail merge: {str(e)}")
+            logger.error("Error processing mail merge: %s", e)
             return False
 
-# Store processors per session
-processors = {}
-splitters = {}
+# Merge pool shared by every request in this process, started on first use
+_merge_pool: Optional[ProcessPoolExecutor] = None
+_merge_pool_lock = threading.Lock()
+
+def _get_merge_pool() -> ProcessPoolExecutor:
+    """Return this process's merge pool, starting it if needed"""
+    global _merge_pool
+    with _merge_pool_lock:
+        if _merge_pool is None:
+            # Forking a threaded worker can copy locks held by other threads, so start pool
+            # processes from a forkserver (or spawn them where forkserver isn't available)
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _merge_pool = ProcessPoolExecutor(max_workers=MERGE_WORKERS, mp_context=context)
+        return _merge_pool
+
+def _reset_merge_pool(pool: ProcessPoolExecutor):
+    """Drop a broken pool so the next large merge starts a fresh one"""
+    global _merge_pool
+    with _merge_pool_lock:
+        if _merge_pool is pool:
+            _merge_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+# Template prepared in a merge worker process, and the key of the template it was prepared from
+_worker_processor: Optional[MailMergeProcessor] = None
+_worker_template_key: Optional[str] = None
+
+def _get_worker_processor(template_key: str, template_bytes: bytes) -> MailMergeProcessor:
+    """Return this worker's processor, preparing the template only when it has changed"""
+    global _worker_processor, _worker_template_key
+    if _worker_template_key != template_key:
+        _worker_processor = MailMergeProcessor()
+        _worker_processor._prepare_template(template_bytes)
+        _worker_template_key = template_key
+    return _worker_processor
+
+def _merge_record_bytes_worker(template_key: str, template_bytes: bytes,
+                               data_rows: List[Dict[str, str]]) -> List[bytes]:
+    """Merge a chunk of records into complete .docx bytes in a worker process"""
+    processor = _get_worker_processor(template_key, template_bytes)
+    return [processor._merge_record_bytes(data_row) for data_row in data_rows]
+
+def _merge_record_body_worker(template_key: str, template_bytes: bytes,
+                              data_rows: List[Dict[str, str]]) -> List[List[bytes]]:
+    """Merge a chunk of records' body content in a worker process, serialized for the parent"""
+    processor = _get_worker_processor(template_key, template_bytes)
+    return [
+        [etree.tostring(child) for child in processor._merge_record_body(data_row)]
+        for data_row in data_rows
+    ]
+
+def _parse_body_children(xml_parts: List[bytes]) -> list:
+    """Turn body content serialized by a worker back into elements"""
+    return [parse_xml(xml) for xml in xml_parts]
+
+# Store processors per session, least recently used first
+processors = OrderedDict()
+splitters = OrderedDict()
+_sessions_lock = threading.Lock()
+
+MAX_SESSIONS = 50
+SESSION_IDLE_TIMEOUT = 30 * 60  # seconds
+SESSION_SWEEP_INTERVAL = 5 * 60  # seconds
 
 def get_processor():
     """Get or create processor for current session"""
     if 'session_id' not in session:
         session['session_id'] = str(uuid.uuid4())
-        print(f"🆕 Created new session: {session['session_id']}")
+        logger.debug("Created new session: %s", session['session_id'])
     
     session_id = session['session_id']
-    print(f"🔄 Using session: {session_id}")
+    logger.debug("Using session: %s", session_id)
     
-    if session_id not in processors:
-        processors[session_id] = MailMergeProcessor(session_id)
-        print(f"🆕 Created new processor for session: {session_id}")
-    else:
-        print(f"♻️  Reusing existing processor for session: {session_id}")
+    with _sessions_lock:
+        if session_id not in processors:
+            processors[session_id] = MailMergeProcessor(session_id)
+            logger.debug("Created new processor for session: %s", session_id)
+        else:
+            logger.debug("Reusing existing processor for session: %s", session_id)
+        
+        # Mark as most recently used
+        processors.move_to_end(session_id)
+        processor = processors[session_id]
+        processor.last_used = time.monotonic()
     
-    print(f"📊 Total active processors: {len(processors)}")
-    return processors[session_id]
+    logger.debug("Total active processors: %d", len(processors))
+    return processor
 
 def get_splitter():
     """Get or create splitter for current session"""
     if 'session_id' not in session:
         session['session_id'] = str(uuid.uuid4())
-        print(f"🆕 Created new session for splitter: {session['session_id']}")
+        logger.debug("Created new session for splitter: %s", session['session_id'])
     
     session_id = session['session_id']
-    print(f"🔄 Using session for splitter: {session_id}")
+    logger.debug("Using session for splitter: %s", session_id)
     
-    if session_id not in splitters:
-        splitters[session_id] = WordSplitter(session_id, OUTPUT_FOLDER)
-        print(f"🆕 Created new splitter for session: {session_id}")
-    else:
-        print(f"♻️  Reusing existing splitter for session: {session_id}")
+    with _sessions_lock:
+        if session_id not in splitters:
+            splitters[session_id] = WordSplitter(session_id, OUTPUT_FOLDER)
+            logger.debug("Created new splitter for session: %s", session_id)
+        else:
+            logger.debug("Reusing existing splitter for session: %s", session_id)
+        
+        # Mark as most recently used
+        splitters.move_to_end(session_id)
+        splitter = splitters[session_id]
+        splitter.last_used = time.monotonic()
     
-    print(f"📊 Total active splitters: {len(splitters)}")
-    return splitters[session_id]
+    logger.debug("Total active splitters: %d", len(splitters))
+    return splitter
 
 def cleanup_old_processors():
-    """Clean up old processors (simple cleanup)"""
-    if len(processors) > 50:  # Clean up if too many processors
-        old_sessions = list(processors.keys())[:25]
-        for session_id in old_sessions:
-            processors[session_id].cleanup()
-            del processors[session_id]
-    
-    if len(splitters) > 50:  # Clean up if too many splitters
-        old_sessions = list(splitters.keys())[:25]
-        for session_id in old_sessions:
-            splitters[session_id].cleanup()
-            del splitters[session_id]
+    """Evict the least recently used processors and splitters beyond MAX_SESSIONS"""
+    evicted = []
+    with _sessions_lock:
+        for registry in (processors, splitters):
+            while len(registry) > MAX_SESSIONS:
+                evicted.append(registry.popitem(last=False)[1])
+    # Clean up outside the registry lock, since a processor may be busy merging
+    for stale in evicted:
+        stale.cleanup()
+
+def _evict_idle_sessions():
+    """Clean up sessions idle for longer than SESSION_IDLE_TIMEOUT, then schedule the next sweep"""
+    try:
+        cutoff = time.monotonic() - SESSION_IDLE_TIMEOUT
+        evicted = []
+        with _sessions_lock:
+            for registry in (processors, splitters):
+                # Registries are ordered by last use, so stop at the first recent session
+                while registry:
+                    oldest = next(iter(registry.values()))
+                    if oldest.last_used > cutoff:
+                        break
+                    evicted.append(registry.popitem(last=False)[1])
+        for stale in evicted:
+            stale.cleanup()
+    except Exception as e:
+        logger.error("Idle session cleanup error: %s", e)
+    finally:
+        _schedule_idle_sweep()
+
+def _schedule_idle_sweep():
+    """Run the idle session sweep again after SESSION_SWEEP_INTERVAL"""
+    timer = threading.Timer(SESSION_SWEEP_INTERVAL, _evict_idle_sessions)
+    timer.daemon = True
+    timer.start()
+
+# Merge pool processes import this module too, but only the serving process owns sessions
+if multiprocessing.parent_process() is None:
+    _schedule_idle_sweep()
+
+def _load_static_asset(path):
+    """Read a static file once, returning (content, etag) or None if it is missing"""
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+        return content, hashlib.blake2s(content).hexdigest()
+    except FileNotFoundError:
+        return None
+
+def _static_response(asset, mimetype):
+    """Build a response for a cached static asset, answering 304 when the browser copy is current"""
+    content, etag = asset
+    response = app.response_class(
+        response=content,
+        status=200,
+        mimetype=mimetype
+    )
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+# Pages and assets don't change while the process runs, so keep them in memory
+_INDEX_HTML = _load_static_asset('index.html')
+_MAILMERGE_HTML = _load_static_asset('mailmerge.html')
+_STYLE_CSS = _load_static_asset('style.css')
+_MAILMERGE_JS = _load_static_asset('mailmerge.js')
 
 # Flask Routes
 @app.route('/')
 def index():
     """Serve the main page"""
-    try:
-        with open('index.html', 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
+    if _INDEX_HTML is None:
         return "<h1>Mail Merge SaaS</h1><p>Main page not found. Please upload index.html</p>"
+    return _static_response(_INDEX_HTML, 'text/html')
 
 @app.route('/mailmerge')
 def mailmerge():
     """Serve the mail merge page"""
-    try:
-        with open('mailmerge.html', 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
+    if _MAILMERGE_HTML is None:
         return "<h1>Mail Merge</h1><p>Mail merge page not found. Please upload mailmerge.html</p>"
+    return _static_response(_MAILMERGE_HTML, 'text/html')
 
 @app.route('/style.css')
 def serve_css():
     """Serve CSS file"""
-    try:
-        with open('style.css', 'r', encoding='utf-8') as f:
-            css_content = f.read()
-        response = app.response_class(
-            response=css_content,
-            status=200,
-            mimetype='text/css'
-        )
-        return response
-    except FileNotFoundError:
+    if _STYLE_CSS is None:
         return "/* CSS file not found */", 404
+    return _static_response(_STYLE_CSS, 'text/css')
 
 @app.route('/mailmerge.js')
 def serve_js():
     """Serve JavaScript file"""
-    try:
-        with open('mailmerge.js', 'r', encoding='utf-8') as f:
-            js_content = f.read()
-        response = app.response_class(
-            response=js_content,
-            status=200,
-            mimetype='application/javascript'
-        )
-        return response
-    except FileNotFoundError:
+    if _MAILMERGE_JS is None:
         return "/* JavaScript file not found */", 404
+    return _static_response(_MAILMERGE_JS, 'application/javascript')
 
 @app.route('/static/<filename>')
 def serve_static(filename):
@@ -666,24 +1027,24 @@ def serve_static(filename):
 def upload_template():
     """Handle template file upload"""
     try:
-        print("Template upload request received")
+        logger.debug("Template upload request received")
         cleanup_old_processors()
         
         processor = get_processor()
         
         if 'file' not in request.files:
-            print("No file in request")
+            logger.info("No file in request")
             return jsonify({'success': False, 'error': 'No file selected'}), 400
         
         file = request.files['file']
         if file.filename == '':
-            print("Empty filename")
+            logger.info("Empty filename")
             return jsonify({'success': False, 'error': 'No file selected'}), 400
         
-        print(f"Template file: {file.filename}")
+        logger.debug("Template file: %s", file.filename)
         
         if not allowed_file(file.filename, ALLOWED_TEMPLATE_EXTENSIONS):
-            print(f"Invalid file type: {file.filename}")
+            logger.info("Invalid file type: %s", file.filename)
             return jsonify({'success': False, 'error': 'Invalid file type. Please upload a .docx file'}), 400
         
         # Create unique filename
@@ -691,13 +1052,11 @@ def upload_template():
         filename = f"template_{processor.session_id}_{timestamp}_{secure_filename(file.filename)}"
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
-        print(f"Template saved to: {filepath}")
+        logger.debug("Template saved to: %s", filepath)
         
         # Load template
         if processor.load_template(filepath):
-            print(f"✅ Template loaded successfully for session {processor.session_id}")
-            print(f"   Template path set to: {processor.template_path}")
-            print(f"   File exists: {os.path.exists(processor.template_path)}")
+            logger.info("Template uploaded for session %s: %s", processor.session_id, processor.template_path)
             return jsonify({
                 'success': True,
                 'message': f'Template uploaded successfully: {file.filename}',
@@ -705,37 +1064,36 @@ def upload_template():
                 'filename': file.filename
             })
         else:
-            print(f"❌ Failed to load template for session {processor.session_id}")
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            logger.warning("Failed to load template for session %s", processor.session_id)
+            _remove_file(filepath)
             return jsonify({'success': False, 'error': 'Invalid template file'}), 400
             
     except Exception as e:
-        print(f"Template upload error: {str(e)}")
+        logger.error("Template upload error: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/upload_data', methods=['POST'])
 def upload_data():
     """Handle data file upload"""
     try:
-        print("Data upload request received")
+        logger.debug("Data upload request received")
         cleanup_old_processors()
         
         processor = get_processor()
         
         if 'file' not in request.files:
-            print("No file in request")
+            logger.info("No file in request")
             return jsonify({'success': False, 'error': 'No file selected'}), 400
         
         file = request.files['file']
         if file.filename == '':
-            print("Empty filename")
+            logger.info("Empty filename")
             return jsonify({'success': False, 'error': 'No file selected'}), 400
         
-        print(f"Data file: {file.filename}")
+        logger.debug("Data file: %s", file.filename)
         
         if not allowed_file(file.filename, ALLOWED_DATA_EXTENSIONS):
-            print(f"Invalid file type: {file.filename}")
+            logger.info("Invalid file type: %s", file.filename)
             return jsonify({'success': False, 'error': 'Invalid file type. Please upload an Excel file (.xlsx)'}), 400
         
         # Create unique filename
@@ -743,12 +1101,12 @@ def upload_data():
         filename = f"data_{processor.session_id}_{timestamp}_{secure_filename(file.filename)}"
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
-        print(f"Data saved to: {filepath}")
+        logger.debug("Data saved to: %s", filepath)
         
         # Load data
         if processor.load_data(filepath):
             # Return preview of data
-            preview_data = processor.data[:3]  # First 3 rows
+            preview_data = [dict(row) for row in processor.data[:3]]  # First 3 rows
             columns = list(processor.data[0].keys()) if processor.data else []
             total_rows = len(processor.data)
             
@@ -762,12 +1120,11 @@ def upload_data():
                 'total_rows': total_rows
             })
         else:
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            _remove_file(filepath)
             return jsonify({'success': False, 'error': 'Invalid data file'}), 400
             
     except Exception as e:
-        print(f"Data upload error: {str(e)}")
+        logger.error("Data upload error: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/check_status', methods=['GET'])
@@ -776,75 +1133,84 @@ def check_status():
     try:
         processor = get_processor()
         
-        # Debug logging
-        print(f"🔍 Status check for session: {processor.session_id}")
-        print(f"   Template path: {processor.template_path}")
-        print(f"   Template exists: {processor.template_path and os.path.exists(processor.template_path) if processor.template_path else False}")
-        print(f"   Data loaded: {len(processor.data) if processor.data else 0} records")
-        
-        # Fallback: If processor doesn't have files, check for recent uploads
-        template_loaded = processor.template_path is not None and os.path.exists(processor.template_path) if processor.template_path else False
-        data_loaded = processor.data_path is not None and len(processor.data) > 0
-        
-        # If files not found in processor, check for recent uploads in the directory
-        if not template_loaded or not data_loaded:
-            print("🔍 Checking for recent uploads as fallback...")
-            if os.path.exists(app.config['UPLOAD_FOLDER']):
-                files = os.listdir(app.config['UPLOAD_FOLDER'])
-                print(f"   Found files: {files}")
-                
-                # Look for recent template files
-                if not template_loaded:
-                    for file in files:
-                        if file.startswith(f'template_{processor.session_id}') and file.endswith('.docx'):
-                            template_path = os.path.join(app.config['UPLOAD_FOLDER'], file)
-                            if processor.load_template(template_path):
-                                template_loaded = True
-                                print(f"✅ Recovered template: {file}")
-                                break
-                
-                # Look for recent data files  
-                if not data_loaded:
-                    for file in files:
-                        if file.startswith(f'data_{processor.session_id}') and file.endswith('.xlsx'):
-                            data_path = os.path.join(app.config['UPLOAD_FOLDER'], file)
-                            if processor.load_data(data_path):
-                                data_loaded = True
-                                print(f"✅ Recovered data: {file}")
-                                break
+        # Hold the session lock so recovery can't interleave with an upload or merge
+        with processor.lock:
+            # Fallback: If processor doesn't have files, check for recent uploads
+            template_loaded = bool(processor.template_path) and os.path.exists(processor.template_path)
+        
+            # Debug logging
+            logger.debug("Status check for session: %s", processor.session_id)
+            logger.debug("Template path: %s (exists: %s)", processor.template_path, template_loaded)
+            logger.debug("Data loaded: %d records", len(processor.data))
+        
+            data_loaded = processor.data_path is not None and len(processor.data) > 0
+        
+            # If files not found in processor, check for recent uploads in the directory
+            if not template_loaded or not data_loaded:
+                logger.debug("Checking for recent uploads as fallback")
+                if os.path.exists(app.config['UPLOAD_FOLDER']):
+                    template_prefix = f'template_{processor.session_id}'
+                    data_prefix = f'data_{processor.session_id}'
+                    template_candidates = []
+                    data_candidates = []
+                    
+                    # Single stat-free pass over the folder collecting the session's files; once
+                    # recovered the processor keeps the paths, so later polls skip the scan
+                    with os.scandir(app.config['UPLOAD_FOLDER']) as entries:
+                        for entry in entries:
+                            name = entry.name
+                            if not template_loaded and name.startswith(template_prefix) and name.endswith('.docx'):
+                                template_candidates.append(entry.path)
+                            elif not data_loaded and name.startswith(data_prefix) and name.endswith('.xlsx'):
+                                data_candidates.append(entry.path)
+                    
+                    # Upload names continue with a fixed-width timestamp after the session prefix, so
+                    # sorting them in reverse tries the newest upload first; skip files that fail to load
+                    for path in sorted(template_candidates, reverse=True):
+                        if processor.load_template(path):
+                            template_loaded = True
+                            logger.info("Recovered template: %s", os.path.basename(path))
+                            break
+                    
+                    # Recover the session's data the same way
+                    for path in sorted(data_candidates, reverse=True):
+                        if processor.load_data(path):
+                            data_loaded = True
+                            logger.info("Recovered data: %s", os.path.basename(path))
+                            break
         
         result = {
             'template_loaded': template_loaded,
             'data_loaded': data_loaded,
-            'template_path': processor.template_path,
             'data_records': len(processor.data) if processor.data else 0,
             'session_id': processor.session_id  # Add for debugging
         }
+        # The frontend never uses the server-side path, only include it when debugging
+        if request.args.get('debug') == '1':
+            result['template_path'] = processor.template_path
         
-        print(f"   Returning status: {result}")
+        logger.debug("Returning status: %s", result)
         return jsonify(result)
         
     except Exception as e:
-        print(f"❌ Status check error: {str(e)}")
+        logger.error("Status check error: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/process_merge', methods=['POST'])
 def process_merge():
     """Process the mail merge - Support both Word and PDF formats"""
     try:
-        print("Process merge request received")
+        logger.debug("Process merge request received")
         
         processor = get_processor()
         data = request.get_json()
         output_format = data.get('format', 'single-word')
         
-        print(f"Output format: {output_format}")
-        print(f"Template loaded: {processor.template_path is not None}")
-        print(f"Data loaded: {len(processor.data) if processor.data else 0} records")
+        logger.info("Merging %d records to %s for session %s", len(processor.data), output_format, processor.session_id)
         
         if not processor.template_path or not processor.data:
-            error_msg = f"Missing files - Template: {processor.template_path is not None}, Data: {len(processor.data) if processor.data else 0} records"
-            print(error_msg)
+            logger.info("Missing files for session %s - Template: %s, Data: %d records",
+                        processor.session_id, processor.template_path is not None, len(processor.data))
             return jsonify({'success': False, 'error': 'Please upload both template and data files first'}), 400
         
         # Generate unique filename
@@ -871,23 +1237,11 @@ def process_merge():
                 return jsonify({'success': False, 'error': 'Failed to process mail merge'}), 500
                 
         else:  # multiple files
-            # Multiple files - create ZIP
-            output_dir = os.path.join(OUTPUT_FOLDER, f"mailmerge_{processor.session_id}_{timestamp}")
+            # Multiple files - documents are written directly into the ZIP
             zip_filename = f"mailmerge_results_{processor.session_id}_{timestamp}.zip"
             zip_path = os.path.join(OUTPUT_FOLDER, zip_filename)
             
-            if processor.process_merge(output_format, output_dir):
-                # Create ZIP file
-                with zipfile.ZipFile(zip_path, 'w') as zipf:
-                    for root, dirs, files in os.walk(output_dir):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.relpath(file_path, output_dir)
-                            zipf.write(file_path, arcname)
-                
-                # Clean up individual files
-                shutil.rmtree(output_dir)
-                
+            if processor.process_merge(output_format, zip_path):
                 return jsonify({
                     'success': True,
                     'message': f'Mail merge completed! Generated {len(processor.data)} {format_name} documents with preserved formatting.',
@@ -898,7 +1252,7 @@ def process_merge():
                 return jsonify({'success': False, 'error': 'Failed to process mail merge'}), 500
                 
     except Exception as e:
-        print(f"Process merge error: {str(e)}")
+        logger.error("Process merge error: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/download/<filename>')
@@ -907,6 +1261,12 @@ def download_file(filename):
     try:
         file_path = os.path.join(OUTPUT_FOLDER, filename)
         if os.path.exists(file_path):
+            if X_ACCEL_REDIRECT_PREFIX:
+                # Let nginx send the file so the worker is freed immediately
+                response = app.response_class(mimetype='application/octet-stream')
+                response.headers['X-Accel-Redirect'] = f"{X_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{quote(filename)}"
+                response.headers.set('Content-Disposition', 'attachment', filename=filename)
+                return response
             return send_file(file_path, as_attachment=True, download_name=filename)
         else:
             return jsonify({'error': 'File not found'}), 404
@@ -966,43 +1326,42 @@ def splitword_js():
 def upload_document():
     """Handle document upload for splitting"""
     try:
-        print("Document upload request received for splitting")
+        logger.debug("Document upload request received for splitting")
         
         splitter = get_splitter()
         
         if 'file' not in request.files:
-            print("No file in request")
+            logger.info("No file in request")
             return jsonify({'success': False, 'error': 'No file selected'}), 400
         
         file = request.files['file']
         if file.filename == '':
-            print("Empty filename")
+            logger.info("Empty filename")
             return jsonify({'success': False, 'error': 'No file selected'}), 400
         
-        print(f"Document file: {file.filename}")
+        logger.debug("Document file: %s", file.filename)
         
         if not allowed_file(file.filename, ALLOWED_TEMPLATE_EXTENSIONS):
-            print(f"Invalid file type: {file.filename}")
+            logger.info("Invalid file type: %s", file.filename)
             return jsonify({'success': False, 'error': 'Only .docx files are allowed'}), 400
         
         # Save uploaded file
         filename = secure_filename(f"split_doc_{splitter.session_id}_{file.filename}")
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
-        print(f"Document saved: {filepath}")
+        logger.debug("Document saved: %s", filepath)
         
         # Load document into splitter
         if splitter.load_document(filepath):
-            print(f"✅ Document loaded successfully for session {splitter.session_id}")
+            logger.info("Document loaded for session %s", splitter.session_id)
             return jsonify({'success': True, 'message': 'Document uploaded successfully'})
         else:
-            print(f"❌ Failed to load document for session {splitter.session_id}")
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            logger.warning("Failed to load document for session %s", splitter.session_id)
+            _remove_file(filepath)
             return jsonify({'success': False, 'error': 'Invalid document file'}), 400
             
     except Exception as e:
-        print(f"Document upload error: {str(e)}")
+        logger.error("Document upload error: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/get_document_pages', methods=['GET'])
@@ -1022,7 +1381,7 @@ def get_document_pages():
         })
         
     except Exception as e:
-        print(f"Error getting document pages: {str(e)}")
+        logger.error("Error getting document pages: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/split_by_range', methods=['POST'])
@@ -1041,7 +1400,7 @@ def split_by_range():
         if not ranges:
             return jsonify({'success': False, 'error': 'No ranges specified'}), 400
         
-        print(f"Splitting by ranges: {ranges}, output_type: {output_type}")
+        logger.info("Splitting by ranges: %s, output_type: %s", ranges, output_type)
         
         result_path = splitter.split_by_range(ranges, output_type)
         
@@ -1059,7 +1418,7 @@ def split_by_range():
         })
         
     except Exception as e:
-        print(f"Error splitting by range: {str(e)}")
+        logger.error("Error splitting by range: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/split_by_pages', methods=['POST'])
@@ -1078,7 +1437,7 @@ def split_by_pages():
         if not selected_pages:
             return jsonify({'success': False, 'error': 'No pages selected'}), 400
         
-        print(f"Splitting by pages: {selected_pages}, output_type: {output_type}")
+        logger.info("Splitting by pages: %s, output_type: %s", selected_pages, output_type)
         
         result_path = splitter.split_by_pages(selected_pages, output_type)
         
@@ -1096,7 +1455,7 @@ def split_by_pages():
         })
         
     except Exception as e:
-        print(f"Error splitting by pages: {str(e)}")
+        logger.error("Error splitting by pages: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 if __name__ == '__main__':
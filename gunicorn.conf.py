@@ -1,6 +1,9 @@
 # Gunicorn Configuration for Render
 bind = "0.0.0.0:10000"
 workers = 2
+# Threaded workers keep serving uploads and status polls while another request is merging
+worker_class = "gthread"
+threads = 4
 timeout = 300
 keepalive = 2
 max_requests = 1000
@@ -3,31 +3,45 @@ Word Document Splitter - Processor Class
 Handles splitting Word documents by ranges or individual pages
 """
 
+import logging
 import os
 import tempfile
 import zipfile
-import shutil
 from datetime import datetime
 from pathlib import Path
 import uuid
+import time
+from copy import deepcopy
 from typing import List, Dict, Any, Optional, Tuple
 
 from docx import Document
 from docx.shared import Inches
 from docx.enum.section import WD_SECTION
 from docx.oxml import parse_xml
-from docx.oxml.ns import nsdecls
+from docx.oxml.ns import nsdecls, qn
 import io
 import base64
 
+# Paragraph containing a single page break, inserted between extracted ranges
+_PAGE_BREAK_XML = f'<w:p {nsdecls("w")}><w:r><w:br w:type="page"/></w:r></w:p>'.encode('utf-8')
+
+_W_BR = qn('w:br')
+_W_P = qn('w:p')
+_W_R = qn('w:r')
+_W_SECTPR = qn('w:sectPr')
+_W_TYPE = qn('w:type')
+
+logger = logging.getLogger(__name__)
+
 class WordSplitter:
     """Handles splitting Word documents into smaller files"""
     
     def __init__(self, session_id=None, output_folder=None):
         self.session_id = session_id or str(uuid.uuid4())
+        self.last_used = time.monotonic()
         self.document_path: Optional[str] = None
         self.document: Optional[Document] = None
-        self.temp_dir = tempfile.mkdtemp()
+        self._document_bytes: Optional[bytes] = None  # Source package, cloned for each extract
         self.output_folder = output_folder or tempfile.mkdtemp()
         self.total_pages = 0
         self.page_breaks = []  # Track where page breaks occur
@@ -35,36 +49,39 @@ class WordSplitter:
     def cleanup(self):
         """Clean up temporary files"""
         try:
-            if self.document_path and os.path.exists(self.document_path):
-                os.remove(self.document_path)
-            if os.path.exists(self.temp_dir):
-                shutil.rmtree(self.temp_dir)
-            print(f"✅ Cleanup completed for split session {self.session_id}")
+            if self.document_path:
+                try:
+                    os.remove(self.document_path)
+                except FileNotFoundError:
+                    pass
+            logger.debug("Cleanup completed for split session %s", self.session_id)
         except Exception as e:
-            print(f"❌ Cleanup error for session {self.session_id}: {e}")
+            logger.error("Cleanup error for session %s: %s", self.session_id, e)
     
     def load_document(self, document_path: str) -> bool:
         """Load and analyze Word document"""
         try:
-            print(f"Loading document: {document_path}")
+            logger.debug("Loading document: %s", document_path)
             
             # Validate file exists and is readable
             if not os.path.exists(document_path):
-                print(f"Document file does not exist: {document_path}")
+                logger.warning("Document file does not exist: %s", document_path)
                 return False
             
             # Load document
-            self.document = Document(document_path)
+            with open(document_path, 'rb') as f:
+                self._document_bytes = f.read()
+            self.document = Document(io.BytesIO(self._document_bytes))
             self.document_path = document_path
             
             # Analyze document structure
             self._analyze_document_structure()
             
-            print(f"✅ Document loaded: {len(self.document.paragraphs)} paragraphs, estimated {self.total_pages} pages")
+            logger.info("Document loaded: %d paragraphs, estimated %d pages", len(self.document.paragraphs), self.total_pages)
             return True
             
         except Exception as e:
-            print(f"❌ Error loading document: {e}")
+            logger.error("Error loading document: %s", e)
             return False
     
     def _analyze_document_structure(self):
@@ -75,18 +92,16 @@ class WordSplitter:
             paragraph_count = 0
             estimated_pages = 1
             
-            for paragraph in self.document.paragraphs:
+            # Walk the body XML directly instead of building paragraph and run wrappers
+            for p in self.document.element.body.iterchildren(_W_P):
                 paragraph_count += 1
                 
                 # Check for explicit page breaks
-                for run in paragraph.runs:
-                    if run._element.xml.find('w:br') is not None:
-                        # Check if it's a page break
-                        br_elements = run._element.findall('.//w:br', run._element.nsmap)
-                        for br in br_elements:
-                            if br.get('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}type') == 'page':
-                                estimated_pages += 1
-                                self.page_breaks.append(paragraph_count)
+                for r in p.iterchildren(_W_R):
+                    for br in r.iter(_W_BR):
+                        if br.get(_W_TYPE) == 'page':
+                            estimated_pages += 1
+                            self.page_breaks.append(paragraph_count)
                 
                 # Rough estimation: every 35-40 paragraphs = 1 page (very approximate)
                 if paragraph_count % 40 == 0:
@@ -96,14 +111,14 @@ class WordSplitter:
             
             # If no explicit page breaks found, create estimated breaks
             if not self.page_breaks and self.total_pages > 1:
-                paragraphs_per_page = max(len(self.document.paragraphs) // self.total_pages, 1)
+                paragraphs_per_page = max(paragraph_count // self.total_pages, 1)
                 for page in range(1, self.total_pages):
                     self.page_breaks.append(page * paragraphs_per_page)
             
-            print(f"Document analysis: {self.total_pages} estimated pages, {len(self.page_breaks)} page breaks detected")
+            logger.debug("Document analysis: %d estimated pages, %d page breaks detected", self.total_pages, len(self.page_breaks))
             
         except Exception as e:
-            print(f"Warning: Error analyzing document structure: {e}")
+            logger.warning("Error analyzing document structure: %s", e)
             self.total_pages = 1
             self.page_breaks = []
     
@@ -145,7 +160,7 @@ class WordSplitter:
             return pages
             
         except Exception as e:
-            print(f"Error generating page thumbnails: {e}")
+            logger.error("Error generating page thumbnails: %s", e)
             # Return single page as fallback
             return [{
                 'page_number': 1,
@@ -161,30 +176,30 @@ class WordSplitter:
             if not self.document:
                 return ""
             
-            preview_text = ""
+            # Collect the pieces and join once instead of growing a string
+            preview_parts = []
             para_count = 0
             
-            for i in range(start_para, min(end_para, len(self.document.paragraphs))):
+            for paragraph in self.document.paragraphs[start_para:end_para]:
                 if para_count >= 3:  # Limit preview to first 3 paragraphs
-                    preview_text += "..."
+                    preview_parts.append("...")
                     break
                     
-                para_text = self.document.paragraphs[i].text.strip()
+                para_text = paragraph.text.strip()
                 if para_text:
-                    preview_text += para_text[:100]  # Limit to 100 chars per paragraph
-                    preview_text += " "
+                    preview_parts.append(para_text[:100])  # Limit to 100 chars per paragraph
                     para_count += 1
             
-            return preview_text.strip()[:200]  # Limit total preview
+            return " ".join(preview_parts)[:200]  # Limit total preview
             
         except Exception as e:
-            print(f"Error getting page preview: {e}")
+            logger.error("Error getting page preview: %s", e)
             return "Preview unavailable"
     
     def split_by_range(self, ranges: List[Dict[str, int]], output_type: str) -> str:
         """Split document by specified page ranges"""
         try:
-            print(f"Splitting document by ranges: {ranges}")
+            logger.debug("Splitting document by ranges: %s", ranges)
             
             if output_type == "separate":
                 return self._split_ranges_separate(ranges)
@@ -192,7 +207,7 @@ class WordSplitter:
                 return self._split_ranges_merged(ranges)
                 
         except Exception as e:
-            print(f"Error splitting by range: {e}")
+            logger.error("Error splitting by range: %s", e)
             raise e
     
     def _split_ranges_separate(self, ranges: List[Dict[str, int]]) -> str:
@@ -207,41 +222,18 @@ class WordSplitter:
                 # Create document for this range
                 range_doc = self._extract_page_range(start_page, end_page)
                 
-                # Save to temporary file
+                # Add to ZIP straight from memory
                 range_filename = f"pages_{start_page}-{end_page}.docx"
-                range_path = os.path.join(self.temp_dir, range_filename)
-                range_doc.save(range_path)
-                
-                # Add to ZIP
-                zipf.write(range_path, range_filename)
-                
-                # Clean up temp file
-                os.remove(range_path)
+                zipf.writestr(range_filename, self._save_to_bytes(range_doc))
         
         return zip_path
     
     def _split_ranges_merged(self, ranges: List[Dict[str, int]]) -> str:
         """Merge ranges into single file"""
-        merged_doc = Document()
-        
-        for i, range_info in enumerate(ranges):
-            start_page = range_info['start']
-            end_page = range_info['end']
-            
-            # Extract content for this range
-            range_content = self._get_range_content(start_page, end_page)
-            
-            # Add content to merged document
-            for paragraph in range_content:
-                new_paragraph = merged_doc.add_paragraph()
-                new_paragraph.text = paragraph.text
-                
-                # Copy paragraph formatting (simplified)
-                new_paragraph.style = paragraph.style
-            
-            # Add page break between ranges (except for last range)
-            if i < len(ranges) - 1:
-                merged_doc.add_page_break()
+        # Page breaks go between ranges
+        merged_doc = self._build_document([
+            self._pages_to_paragraphs(range_info['start'], range_info['end']) for range_info in ranges
+        ])
         
         # Save merged document
         merged_path = os.path.join(self.output_folder, f"merged_ranges_{self.session_id}.docx")
@@ -252,7 +244,7 @@ class WordSplitter:
     def split_by_pages(self, selected_pages: List[int], output_type: str) -> str:
         """Split document by individual pages"""
         try:
-            print(f"Splitting document by pages: {selected_pages}")
+            logger.debug("Splitting document by pages: %s", selected_pages)
             
             if output_type == "separate":
                 return self._split_pages_separate(selected_pages)
@@ -260,7 +252,7 @@ class WordSplitter:
                 return self._split_pages_merged(selected_pages)
                 
         except Exception as e:
-            print(f"Error splitting by pages: {e}")
+            logger.error("Error splitting by pages: %s", e)
             raise e
     
     def _split_pages_separate(self, pages: List[int]) -> str:
@@ -272,38 +264,18 @@ class WordSplitter:
                 # Create document for this page
                 page_doc = self._extract_single_page(page_num)
                 
-                # Save to temporary file
+                # Add to ZIP straight from memory
                 page_filename = f"page_{page_num}.docx"
-                page_path = os.path.join(self.temp_dir, page_filename)
-                page_doc.save(page_path)
-                
-                # Add to ZIP
-                zipf.write(page_path, page_filename)
-                
-                # Clean up temp file
-                os.remove(page_path)
+                zipf.writestr(page_filename, self._save_to_bytes(page_doc))
         
         return zip_path
     
     def _split_pages_merged(self, pages: List[int]) -> str:
         """Merge selected pages into single file"""
-        merged_doc = Document()
-        
-        for i, page_num in enumerate(sorted(pages)):
-            # Extract content for this page
-            page_content = self._get_single_page_content(page_num)
-            
-            # Add content to merged document
-            for paragraph in page_content:
-                new_paragraph = merged_doc.add_paragraph()
-                new_paragraph.text = paragraph.text
-                
-                # Copy paragraph formatting (simplified)
-                new_paragraph.style = paragraph.style
-            
-            # Add page break between pages (except for last page)
-            if i < len(pages) - 1:
-                merged_doc.add_page_break()
+        # Page breaks go between pages
+        merged_doc = self._build_document([
+            self._pages_to_paragraphs(page_num, page_num) for page_num in sorted(pages)
+        ])
         
         # Save merged document
         merged_path = os.path.join(self.output_folder, f"merged_pages_{self.session_id}.docx")
@@ -311,50 +283,44 @@ class WordSplitter:
         
         return merged_path
     
-    def _extract_page_range(self, start_page: int, end_page: int) -> Document:
-        """Extract a range of pages into a new document"""
-        new_doc = Document()
+    def _save_to_bytes(self, doc: Document) -> bytes:
+        """Serialize a document to .docx bytes without a temporary file"""
+        buf = io.BytesIO()
+        doc.save(buf)
+        return buf.getvalue()
+    
+    def _build_document(self, paragraph_ranges: List[Tuple[int, int]]) -> Document:
+        """Build a document from inclusive paragraph index ranges, with page breaks between ranges"""
+        # Start from a copy of the source package so styles, numbering and images still resolve,
+        # then swap its body for deep copies of the selected paragraph elements
+        new_doc = Document(io.BytesIO(self._document_bytes))
+        body = new_doc.element.body
+        paragraphs = list(body.iterchildren(_W_P))
+        sect_pr = body.find(_W_SECTPR)
         
-        # Get content for the page range
-        content = self._get_range_content(start_page, end_page)
+        new_children = []
+        for i, (start_para, end_para) in enumerate(paragraph_ranges):
+            if i:
+                new_children.append(parse_xml(_PAGE_BREAK_XML))
+            new_children.extend(deepcopy(p) for p in paragraphs[start_para:end_para + 1])
         
-        # Add content to new document
-        for paragraph in content:
-            new_paragraph = new_doc.add_paragraph()
-            new_paragraph.text = paragraph.text
-            
-            # Copy basic formatting
-            try:
-                new_paragraph.style = paragraph.style
-            except:
-                pass  # Skip if style copying fails
+        # The body-level sectPr stays the last child
+        for child in list(body):
+            body.remove(child)
+        body.extend(new_children)
+        if sect_pr is not None:
+            body.append(sect_pr)
         
         return new_doc
     
+    def _extract_page_range(self, start_page: int, end_page: int) -> Document:
+        """Extract a range of pages into a new document"""
+        return self._build_document([self._pages_to_paragraphs(start_page, end_page)])
+    
     def _extract_single_page(self, page_num: int) -> Document:
         """Extract a single page into a new document"""
         return self._extract_page_range(page_num, page_num)
     
-    def _get_range_content(self, start_page: int, end_page: int) -> List[Any]:
-        """Get paragraph content for a page range"""
-        try:
-            if not self.document:
-                return []
-            
-            # Convert page numbers to paragraph indices
-            start_para, end_para = self._pages_to_paragraphs(start_page, end_page)
-            
-            # Return paragraphs in range
-            return self.document.paragraphs[start_para:end_para + 1]
-            
-        except Exception as e:
-            print(f"Error getting range content: {e}")
-            return []
-    
-    def _get_single_page_content(self, page_num: int) -> List[Any]:
-        """Get paragraph content for a single page"""
-        return self._get_range_content(page_num, page_num)
-    
     def _pages_to_paragraphs(self, start_page: int, end_page: int) -> Tuple[int, int]:
         """Convert page numbers to paragraph indices"""
         try:
@@ -386,5 +352,5 @@ class WordSplitter:
             return start_para, end_para
             
         except Exception as e:
-            print(f"Error converting pages to paragraphs: {e}")
+            logger.error("Error converting pages to paragraphs: %s", e)
             return 0, len(self.document.paragraphs) - 1 if self.document else (0, 0)
\ No newline at end of file